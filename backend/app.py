@@ -1,20 +1,36 @@
+import logging
 import secrets
 import sqlite3
 import os
-import json
+import time
 import zoneinfo
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from functools import wraps
+from functools import lru_cache, wraps
 
 import dotenv
+import orjson
+import redis
 import requests
-from flask import Flask, request, jsonify, redirect, session, url_for
+from flask import Flask, g, request, jsonify, redirect, session, url_for
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from flask_session import Session
+from itsdangerous import BadSignature, URLSafeTimedSerializer
 from oauthlib.oauth2 import WebApplicationClient
+from requests.adapters import HTTPAdapter
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from utils import rate_limit
 
+log = logging.getLogger(__name__)
+
+# Under gunicorn, log through its error log so messages follow its --log-level
+_gunicorn_log = logging.getLogger("gunicorn.error")
+if _gunicorn_log.handlers:
+    log.handlers = _gunicorn_log.handlers
+    log.setLevel(_gunicorn_log.level)
+
 
 # Configuration
 dotenv.load_dotenv()
@@ -26,29 +42,88 @@ ALLOWED_EMAIL = os.environ.get("ALLOWED_EMAIL")
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000")
 DATABASE_PATH = os.environ.get("DATABASE_PATH", "meals.db")
 DEFAULT_TIMEZONE = os.environ.get("DEFAULT_TIMEZONE", "America/New_York")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+GOOGLE_DISCOVERY_TTL = 3600  # Refetch the discovery document hourly
+
+# Fixed redirect targets and responses for the auth routes
+_ADMIN_URL = f"{FRONTEND_URL}/#admin"
+_HOME_URL = FRONTEND_URL
+_UNAUTH_RESP = {"authenticated": False}
+
+# Signed cookie proving the allowed user logged in
+AUTH_COOKIE_NAME = "auth_token"
+AUTH_TOKEN_SALT = "auth"
+AUTH_TOKEN_KEY_PREFIX = "auth_token:"  # Redis keys of live tokens, deleted on logout
+
+# Kept constant so SQLite's statement cache reuses the compiled statement
+INSERT_MEAL_SQL = "INSERT INTO meals (ate, timestamp) VALUES (?, ?)"
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson instead of the stdlib json module"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
-app.secret_key = secrets.token_hex(16)  # Generate a random secret key
+# Workers must share the key to accept each other's cookies. A random key
+# is only acceptable for the single-process development server.
+if not FLASK_SECRET_KEY and __name__ != "__main__" and not app.debug:
+    raise RuntimeError(
+        "FLASK_SECRET_KEY is not set. Set it in backend/.env, every worker "
+        "must sign sessions and auth tokens with the same key."
+    )
+app.secret_key = FLASK_SECRET_KEY or secrets.token_hex(16)
 app.config["SESSION_COOKIE_HTTPONLY"] = True
 app.config["SESSION_COOKIE_SECURE"] = True  # Set to False for development without HTTPS
 app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=7)  # Session lasts 7 days
+redis_client = redis.Redis.from_url(REDIS_URL)
+# Keep session data server-side in Redis, the cookie only carries the session ID
+app.config["SESSION_TYPE"] = "redis"
+app.config["SESSION_REDIS"] = redis_client
+app.config["SESSION_PERMANENT"] = True
+Session(app)
+app.config["RATE_LIMIT_REDIS"] = redis_client  # Shared rate limit counters
 CORS(app, supports_credentials=True)  # Enable CORS with credentials support
 
 # OAuth 2 client setup
 client = WebApplicationClient(GOOGLE_CLIENT_ID)
 
+# Signs the auth token cookie, which carries the ID of a token stored in Redis
+auth_serializer = URLSafeTimedSerializer(app.secret_key, salt=AUTH_TOKEN_SALT)
+
+# Shared HTTP session, keeps connections to Google and Telegram alive
+HTTP = requests.Session()
+HTTP.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+
+# Background workers for outgoing notifications
+_notify_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="notify")
+
 
 # Helper functions for timezone handling
-def get_timezone():
-    """Get the timezone object from the configured timezone name"""
+def _load_timezone():
+    """Load the timezone object for the configured timezone name"""
     try:
         return zoneinfo.ZoneInfo(DEFAULT_TIMEZONE)
     except Exception as e:
-        print(f"Error loading timezone {DEFAULT_TIMEZONE}: {e}")
+        log.warning("Error loading timezone %s: %s", DEFAULT_TIMEZONE, e)
         return timezone.utc
 
 
+_TZ = _load_timezone()
+
+
+def get_timezone():
+    """Get the timezone object from the configured timezone name"""
+    return _TZ
+
+
 def now_in_timezone():
     """Get current time in the configured timezone"""
     return datetime.now(timezone.utc).astimezone(get_timezone())
@@ -85,17 +160,36 @@ def datetime_to_str(dt):
     return dt.astimezone(get_timezone()).isoformat()
 
 
+def db_timestamp_to_str(timestamp_str, tz=_TZ):
+    """Convert a timestamp string from the database to an ISO string in tz"""
+    if not timestamp_str:
+        return timestamp_str
+    # Fast path for what log_meal stores: isoformat() with a "+00:00" offset,
+    # or the frontend's toISOString() ending in "Z"
+    if timestamp_str[-1] == "Z" or (
+        timestamp_str[-6:-5] in ("+", "-") and timestamp_str[-3:-2] == ":"
+    ):
+        return datetime.fromisoformat(timestamp_str).astimezone(tz).isoformat()
+    # SQLite's CURRENT_TIMESTAMP format, "YYYY-MM-DD HH:MM:SS" in UTC
+    if len(timestamp_str) == 19 and timestamp_str[10] == " ":
+        dt = datetime.fromisoformat(timestamp_str).replace(tzinfo=timezone.utc)
+        return dt.astimezone(tz).isoformat()
+    return datetime_to_str(datetime_from_str(timestamp_str))
+
+
 # Initialize database only if it doesn't exist
 def init_db_if_needed():
     db_path = DATABASE_PATH
     db_exists = os.path.exists(db_path)
 
+    conn = sqlite3.connect(db_path)
+
     # Only initialize if the database file doesn't exist
     if not db_exists:
-        print("Database not found. Creating new database...")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(
+        log.info("Database not found. Creating new database...")
+        # auto_vacuum must be set before the first table is created
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute(
             """
         CREATE TABLE IF NOT EXISTS meals (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -105,34 +199,102 @@ def init_db_if_needed():
         """
         )
         conn.commit()
-        conn.close()
-        print("Database initialized successfully.")
+        log.info("Database initialized successfully.")
     else:
-        print("Database already exists. Skipping initialization.")
+        log.info("Database already exists. Skipping initialization.")
+
+    # WAL mode is persisted in the database file, so every later
+    # connection picks it up; per-connection pragmas are set in get_db()
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    # Latest-meal lookups order by timestamp, let them use an index
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_meals_ts ON meals(timestamp DESC)")
+    conn.commit()
+    conn.close()
 
 
 # Check if database needs to be initialized
 init_db_if_needed()
 
 
+def get_db():
+    """Get the database connection for the current app context"""
+    if "db" not in g:
+        # Autocommit mode, writers open their own transactions explicitly.
+        # timeout is SQLite's busy timeout: wait up to 5s on a locked database.
+        g.db = sqlite3.connect(
+            DATABASE_PATH, timeout=5, check_same_thread=False, isolation_level=None
+        )
+        g.db.row_factory = sqlite3.Row
+        g.db.execute("PRAGMA synchronous=NORMAL")
+        g.db.execute("PRAGMA temp_store=MEMORY")
+        g.db.execute("PRAGMA mmap_size=268435456")
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db(e=None):
+    db = g.pop("db", None)
+    if db is not None:
+        if db.in_transaction:
+            db.rollback()
+        db.close()
+
+
+def issue_auth_token(user_name):
+    """Create an auth token for the allowed user and register it in Redis"""
+    token_id = secrets.token_urlsafe(16)
+    redis_client.set(
+        AUTH_TOKEN_KEY_PREFIX + token_id,
+        user_name,
+        ex=app.config["PERMANENT_SESSION_LIFETIME"],
+    )
+    return auth_serializer.dumps(token_id)
+
+
+def get_auth_token_id(max_age=None):
+    """Get the token ID from the auth token cookie, None if it is not valid"""
+    token = request.cookies.get(AUTH_COOKIE_NAME)
+    if not token:
+        return None
+    try:
+        return auth_serializer.loads(token, max_age=max_age)
+    except BadSignature:
+        return None
+
+
+def get_auth_user_name():
+    """Get the user name from a valid auth token cookie, None if there is none"""
+    token_id = get_auth_token_id(
+        max_age=int(app.config["PERMANENT_SESSION_LIFETIME"].total_seconds())
+    )
+    if token_id is None:
+        return None
+    # Tokens are revoked on logout by deleting their Redis key
+    user_name = redis_client.get(AUTH_TOKEN_KEY_PREFIX + token_id)
+    return user_name.decode() if user_name is not None else None
+
+
 # Authentication decorator
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if "user_email" not in session:
-            return (
-                jsonify({"error": "Authentication required", "authenticated": False}),
-                401,
-            )
+        # Tokens are only issued to the allowed email
+        if get_auth_user_name() is not None:
+            return f(*args, **kwargs)
 
-        # Check if the user's email matches the allowed email
-        if session["user_email"] != ALLOWED_EMAIL:
+        # Logged in as someone other than the allowed email
+        if "user_email" in session and session["user_email"] != ALLOWED_EMAIL:
             return (
                 jsonify({"error": "Unauthorized access", "authenticated": False}),
                 403,
             )
 
-        return f(*args, **kwargs)
+        # Not logged in, or the allowed user's token is missing or expired
+        return (
+            jsonify({"error": "Authentication required", "authenticated": False}),
+            401,
+        )
 
     return decorated_function
 
@@ -170,109 +332,119 @@ def callback():
         redirect_url=request.base_url,
         code=code,
     )
-    token_response = requests.post(
+    token_response = HTTP.post(
         token_url,
         headers=headers,
         data=body,
         auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
     )
 
-    # Parse the tokens
-    client.parse_request_body_response(json.dumps(token_response.json()))
+    # Parse the tokens, the raw body is already JSON so hand it over as is
+    client.parse_request_body_response(token_response.text)
 
     # Get user info from Google
     userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
     uri, headers, body = client.add_token(userinfo_endpoint)
-    userinfo_response = requests.get(uri, headers=headers, data=body)
+    userinfo_response = HTTP.get(uri, headers=headers, data=body)
+    userinfo = orjson.loads(userinfo_response.content)
 
     # Verify user email
-    if userinfo_response.json().get("email_verified"):
-        user_email = userinfo_response.json()["email"]
-        user_name = userinfo_response.json()["given_name"]
-
-        # Store user information in session
-        session["user_email"] = user_email
-        session["user_name"] = user_name
-        session.permanent = True
+    if userinfo.get("email_verified"):
+        user_email = userinfo["email"]
+        user_name = userinfo["given_name"]
 
         # Check if the user's email matches the allowed email
         if user_email == ALLOWED_EMAIL:
-            # Redirect to frontend with success
-            return redirect(f"{FRONTEND_URL}/#admin")
+            # The auth token is the only login state for the allowed user,
+            # drop any session left over from logging in as someone else
+            session.clear()
+
+            # Redirect to frontend with success and hand out the auth token
+            response = redirect(_ADMIN_URL)
+            response.set_cookie(
+                AUTH_COOKIE_NAME,
+                issue_auth_token(user_name),
+                max_age=app.config["PERMANENT_SESSION_LIFETIME"],
+                secure=app.config["SESSION_COOKIE_SECURE"],
+                httponly=True,
+            )
+            return response
         else:
+            # Remember other users in the session to answer them with 403
+            session["user_email"] = user_email
+            session["user_name"] = user_name
+            session.permanent = True
+
             # Redirect to frontend with unauthorized
-            return redirect(f"{FRONTEND_URL}")
+            return redirect(_HOME_URL)
     else:
         return jsonify({"error": "User email not verified by Google"}), 400
 
 
 @app.route("/api/auth/status", methods=["GET"])
 def auth_status():
-    if "user_email" in session and session["user_email"] == ALLOWED_EMAIL:
+    user_name = get_auth_user_name()
+    if user_name is not None:
         return jsonify(
             {
                 "authenticated": True,
-                "email": session["user_email"],
-                "name": session.get("user_name", ""),
+                "email": ALLOWED_EMAIL,
+                "name": user_name,
             }
         )
-    return jsonify({"authenticated": False})
+    return jsonify(_UNAUTH_RESP)
 
 
 @app.route("/api/auth/logout", methods=["POST"])
 def logout():
     session.clear()
-    return jsonify({"success": True})
+    token_id = get_auth_token_id()
+    if token_id is not None:
+        redis_client.delete(AUTH_TOKEN_KEY_PREFIX + token_id)
+    response = jsonify({"success": True})
+    response.delete_cookie(AUTH_COOKIE_NAME)
+    return response
+
+
+@lru_cache(maxsize=1)
+def _get_google_provider_cfg(bucket):
+    # `bucket` only changes every GOOGLE_DISCOVERY_TTL seconds, which
+    # invalidates the cached document
+    return HTTP.get(GOOGLE_DISCOVERY_URL, timeout=5).json()
 
 
 def get_google_provider_cfg():
-    return requests.get(GOOGLE_DISCOVERY_URL).json()
+    return _get_google_provider_cfg(int(time.time()) // GOOGLE_DISCOVERY_TTL)
 
 
 # API routes
 @app.route("/api/meals", methods=["GET"])
 def get_meal_status():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    # Get the most recent meal entry
-    cursor.execute("SELECT ate, timestamp FROM meals ORDER BY timestamp DESC LIMIT 1")
+    # Get the most recent meal entry, letting SQLite compute its age in seconds
+    cursor = get_db().execute(
+        "SELECT ate, timestamp, (julianday('now') - julianday(timestamp)) * 86400.0 "
+        "FROM meals ORDER BY timestamp DESC LIMIT 1"
+    )
     result = cursor.fetchone()
-    conn.close()
 
     if result is None:
         return jsonify({"ate": False, "timestamp": None})
 
-    ate, timestamp = result
-
-    # Check if the last meal was more than 3 hours ago
-    if timestamp:
-        eastern = zoneinfo.ZoneInfo("America/New_York")
-
-        last_meal_time = datetime.fromisoformat(
-            timestamp.replace("Z", "+00:00")
-        ).astimezone(eastern)
-
-        # XXX: WHYYYYYYYYYYYYYYYYYYYYYY do you hard code timezone?
-        utc_now = datetime.now(timezone.utc)
-        current_time = utc_now.astimezone(eastern)
-        time_difference = current_time - last_meal_time
-
-        # If more than 3 hours have passed and the last status was "ate",
-        # automatically change to "not eaten"
-        if time_difference.total_seconds() > 3 * 60 * 60 and bool(ate):
-            return jsonify(
-                {
-                    "ate": False,
-                    "timestamp": None,
-                    "last_meal_timestamp": last_meal_time,
-                    "status_changed": True,
-                    "time_since_last_meal": int(time_difference.total_seconds() / 60),
-                }
-            )
+    ate, timestamp, age_seconds = result
 
-        # Within the time, replace timestamp to local time
-    #        timestamp = last_meal_time
+    # If more than 3 hours have passed and the last status was "ate",
+    # automatically change to "not eaten". age_seconds is None when the
+    # timestamp is missing or SQLite cannot parse it.
+    if age_seconds is not None and age_seconds > 3 * 60 * 60 and bool(ate):
+        return jsonify(
+            {
+                "ate": False,
+                "timestamp": None,
+                "last_meal_timestamp": datetime_from_str(timestamp),
+                "status_changed": True,
+                "time_since_last_meal": int(age_seconds / 60),
+            }
+        )
 
     return jsonify({"ate": bool(ate), "timestamp": timestamp})
 
@@ -289,22 +461,23 @@ def log_meal():
     timestamp = (
         custom_timestamp if custom_timestamp else datetime.now(timezone.utc).isoformat()
     )
-    print(timestamp)
+    log.debug("Logging meal at %s", timestamp)
 
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("INSERT INTO meals (ate, timestamp) VALUES (?, ?)", (ate, timestamp))
-    conn.commit()
-    conn.close()
+    # A single statement in autocommit mode runs in its own transaction
+    get_db().execute(INSERT_MEAL_SQL, (ate, timestamp))
 
     return jsonify({"success": True, "ate": ate, "timestamp": timestamp})
 
 
+def _log_notify_error(future):
+    if future.exception() is not None:
+        log.error("Error sending Telegram reminder: %s", future.exception())
+
+
 @app.route("/api/remind", methods=["POST"])
 @rate_limit(3, 3600)
 def send_reminder():
-    print("Reminder to eat sent at", datetime.now().isoformat())
+    log.debug("Reminder to eat sent at %s", datetime.now().isoformat())
     data = request.get_json() if request.is_json else {}
     custom_message = data.get("message", "Time to eat!")
     sender = data.get("sender", "Guest")
@@ -317,12 +490,15 @@ def send_reminder():
         # Format telegram message
         message = f"🔔 <b>Meal Reminder from {sender}</b>\n\n{custom_message}"
 
-        # Send to Telegram
+        # Send to Telegram in the background, don't keep the client waiting
         telegram_url = f"https://api.telegram.org/bot{telegram_token}/sendMessage"
-        requests.post(
+        future = _notify_pool.submit(
+            HTTP.post,
             telegram_url,
             data={"chat_id": telegram_chat_id, "text": message, "parse_mode": "HTML"},
+            timeout=(3, 5),
         )
+        future.add_done_callback(_log_notify_error)
 
     return jsonify({"success": True, "message": "Reminder sent"})
 
@@ -335,34 +511,29 @@ def get_recent_meals():
         # Get query parameter for limit (default to 5)
         limit = request.args.get("limit", 5, type=int)
 
-        # Connect to database
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-
         # Get recent meals with limit
-        cursor.execute(
-            "SELECT id, ate, timestamp FROM meals ORDER BY timestamp DESC LIMIT ?",
-            (limit,),
-        )
-        meals = cursor.fetchall()
-        conn.close()
-
-        # Format results
-        result = []
-        for meal_id, ate, timestamp in meals:
-            # Convert timestamp to timezone-aware datetime
-            formatted_time = timestamp
-            if timestamp:
-                dt = datetime_from_str(timestamp)
-                formatted_time = datetime_to_str(dt)
-
-            result.append(
-                {"id": meal_id, "ate": bool(ate), "timestamp": formatted_time}
+        meals = (
+            get_db()
+            .execute(
+                "SELECT id, ate, timestamp FROM meals ORDER BY timestamp DESC LIMIT ?",
+                (limit,),
             )
+            .fetchall()
+        )
+
+        # Format results, converting timestamps to the configured timezone
+        result = [
+            {
+                "id": meal_id,
+                "ate": bool(ate),
+                "timestamp": db_timestamp_to_str(timestamp),
+            }
+            for meal_id, ate, timestamp in meals
+        ]
 
         return jsonify({"success": True, "meals": result})
-    except Exception as e:
-        print(f"Error getting recent meals: {str(e)}")
+    except Exception:
+        log.exception("Error getting recent meals")
         return jsonify({"success": False, "error": "Failed to get recent meals"}), 500
 
 
@@ -372,29 +543,28 @@ def delete_meal(meal_id):
     """Delete a meal entry by ID"""
     try:
         # Connect to database
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
+        conn = get_db()
 
         # Check if meal exists
-        cursor.execute("SELECT id FROM meals WHERE id = ?", (meal_id,))
-        meal = cursor.fetchone()
+        conn.execute("BEGIN IMMEDIATE")
+        meal = conn.execute("SELECT id FROM meals WHERE id = ?", (meal_id,)).fetchone()
 
         if not meal:
-            conn.close()
+            conn.execute("ROLLBACK")
             return jsonify({"success": False, "error": "Meal not found"}), 404
 
         # Delete the meal
-        cursor.execute("DELETE FROM meals WHERE id = ?", (meal_id,))
-        conn.commit()
-        conn.close()
+        conn.execute("DELETE FROM meals WHERE id = ?", (meal_id,))
+        conn.execute("COMMIT")
 
         return jsonify(
             {"success": True, "message": f"Meal with ID {meal_id} deleted successfully"}
         )
-    except Exception as e:
-        print(f"Error deleting meal: {str(e)}")
+    except Exception:
+        log.exception("Error deleting meal")
         return jsonify({"success": False, "error": "Failed to delete meal"}), 500
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
     app.run(debug=True)